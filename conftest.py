@@ -0,0 +1 @@
+# Keeps the repository root on sys.path so the tests can import spec0_bot under a bare `pytest`
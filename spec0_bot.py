@@ -1,12 +1,20 @@
 import os
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import shutil
 import subprocess
-from datetime import datetime
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 from packaging.requirements import Requirement
 from packaging.version import Version
 import uuid
-import toml
+import tomlkit
+import tomlkit.exceptions
 import logging
 logging.basicConfig(level=logging.INFO)
 import sys
@@ -18,8 +26,69 @@ try:
 except ImportError:
     Github = None  # Let's do a dry-run
 
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None  # Fall back to an uncached session
+
+try:
+    import ijson
+except ImportError:
+    ijson = None  # Always decode the full response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Use the stdlib decoder behind resp.json()
+
 SPEC0_DEP_AGE_YEARS = 2
 PYPI_URL = "https://pypi.org/pypi/{}/json"
+PYPI_MAX_WORKERS = 16
+PYPI_STREAM_THRESHOLD = 512 * 1024  # bytes on the wire above which the response is stream-parsed
+PYPI_CACHE = os.path.join(
+    os.getenv("SPEC0_CACHE_DIR", os.path.expanduser("~/.cache/spec0-bot")), "pypi"
+)
+
+# Requirement lines: capture the package name, followed by an optional version specifier
+REQUIREMENT_LINE_RE = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)\s*([<>=!~]=?.*)?$")
+# Requirements embedded in setup.py strings: capture the package name and the pinned version
+SETUP_REQUIREMENT_RE = re.compile(r"([A-Za-z0-9][A-Za-z0-9._-]*)\s*[<>=!~]=?\s*([A-Za-z0-9.*+!_-]+)")
+
+# Shared session so all PyPI lookups reuse the same keep-alive connection(s),
+# backed by an on-disk cache when requests-cache is available. Created on first use,
+# so importing this module never touches the cache directory.
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _get_session():
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            if requests_cache:
+                session = requests_cache.CachedSession(
+                    cache_name=PYPI_CACHE,
+                    backend="sqlite",
+                    expire_after=timedelta(hours=6),
+                    allowable_codes=(200,),
+                )
+            else:
+                session = requests.Session()
+            session.mount(
+                "https://",
+                HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=32,
+                    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504]),
+                ),
+            )
+            _SESSION = session
+    return _SESSION
+
+
+@functools.lru_cache(maxsize=8192)
+def _parse_version(version_str):
+    return Version(version_str)
 
 
 def parse_requirements_txt(path):
@@ -27,78 +96,139 @@ def parse_requirements_txt(path):
         return [line.strip() for line in f if line.strip() and not line.startswith("#")]
 
 
-def get_release_date(pkg_name, version):
-    try:
-        url = f"https://pypi.org/pypi/{pkg_name}/json"
-        resp = requests.get(url, timeout=10)
+@functools.lru_cache(maxsize=None)
+def _fetch_pypi_json(pkg_name):
+    with _get_session().get(PYPI_URL.format(pkg_name), timeout=10, stream=True) as resp:
         resp.raise_for_status()
-        data = resp.json()
-        version_str = str(Version(version))
-        releases = data.get("releases", {})
-        if version_str not in releases or not releases[version_str]:
-            return None
-        upload_info = releases[version_str][0]
-        return datetime.fromisoformat(upload_info["upload_time_iso_8601"].rstrip("Z"))
-    except Exception as e:
-        print(f"Failed to get release date for {pkg_name}=={version}: {e}")
+        size = int(resp.headers.get("Content-Length", 0))
+        # requests-cache reads the whole body to store it, so only an uncached session can stream
+        if ijson and requests_cache is None and size > PYPI_STREAM_THRESHOLD:
+            return _stream_releases(resp)
+        return orjson.loads(resp.content) if orjson else resp.json()
+
+
+def _stream_releases(resp):
+    """
+    Stream-parse a large PyPI response, keeping only the upload time of the first file of each release.
+    The result has the same layout as the full JSON, restricted to what the SPEC-0 checks read.
+    """
+    prefix_len, suffix_len = len("releases."), len(".item.upload_time_iso_8601")
+    releases = {}
+    resp.raw.decode_content = True
+    for prefix, event, value in ijson.parse(resp.raw):
+        if value and prefix.startswith("releases.") and prefix.endswith(".item.upload_time_iso_8601"):
+            version_str = prefix[prefix_len:-suffix_len]
+            if version_str not in releases:
+                releases[version_str] = [{"upload_time_iso_8601": value}]
+    return {"releases": releases}
+
+
+def _release_date_from(data, version):
+    version_str = str(_parse_version(version))
+    releases = data.get("releases", {})
+    if version_str not in releases or not releases[version_str]:
         return None
+    upload_info = releases[version_str][0]
+    return datetime.fromisoformat(upload_info["upload_time_iso_8601"].rstrip("Z"))
 
 
-def get_latest_version(pkg_name):
+def spec0_cutoff():
     """
-    Return the oldest version of the package still within the SPEC-0 support window (last 2 years).
+    Return the start of the SPEC-0 support window as a naive UTC datetime, like the PyPI upload times.
     """
-    try:
-        url = f"https://pypi.org/pypi/{pkg_name}/json"
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now - timedelta(days=SPEC0_DEP_AGE_YEARS * 365.25)
 
-        releases = data.get("releases", {})
-        spec0_cutoff = datetime.now().timestamp() - (SPEC0_DEP_AGE_YEARS * 365.25 * 24 * 3600)
 
-        # Collect (version, upload_time) pairs for versions within the support window
-        compliant_versions = []
-        for version_str, files in releases.items():
-            if not files:
-                continue
+def _compliant_version_from(data, cutoff):
+    """
+    Return the oldest version in the PyPI metadata uploaded on or after cutoff.
+    """
+    releases = data.get("releases", {})
+    # PyPI upload times are UTC ISO-8601 strings, which sort chronologically as plain strings
+    cutoff_iso = cutoff.strftime("%Y-%m-%dT%H:%M:%S")
+
+    # Track the OLDEST release within the support window in a single pass
+    oldest, oldest_time = None, None
+    for version_str, files in releases.items():
+        if not files:
+            continue
+        upload_time = files[0].get("upload_time_iso_8601")
+        if not upload_time or upload_time < cutoff_iso:
+            continue
+        if oldest_time is None or upload_time < oldest_time:
             try:
-                upload_time = files[0].get("upload_time_iso_8601")
-                if upload_time:
-                    dt = datetime.fromisoformat(upload_time.rstrip("Z"))
-                    if dt.timestamp() >= spec0_cutoff:
-                        compliant_versions.append((Version(version_str), dt))
+                # Only releases that could be the answer get their version parsed
+                oldest, oldest_time = _parse_version(version_str), upload_time
             except Exception:
                 continue
 
-        if compliant_versions:
-            # Return the OLDEST version within the compliant window
-            oldest = sorted(compliant_versions, key=lambda x: x[1])[0]
-            return str(oldest[0])
+    return str(oldest) if oldest is not None else None
 
-        return None
+
+def _check_one(pkg, required_version, cutoff):
+    """
+    Check a single pinned dependency against PyPI.
+    Returns (pkg, required_version, release_date, latest), where latest is the oldest
+    SPEC-0-compliant version if the pin is outdated and None otherwise.
+    """
+    try:
+        data = _fetch_pypi_json(pkg)
     except Exception as e:
-        print(f"Failed to get compliant version of {pkg_name}: {e}")
-        return None
+        print(f"Failed to fetch PyPI metadata for {pkg}: {e}")
+        return pkg, required_version, None, None
+
+    # A pin at or above the oldest compliant version needs no release-date lookup
+    latest = _compliant_version_from(data, cutoff)
+    if not latest or required_version >= _parse_version(latest):
+        return pkg, required_version, None, None
+
+    try:
+        release_date = _release_date_from(data, str(required_version))
+    except Exception as e:
+        print(f"Failed to get release date for {pkg}=={required_version}: {e}")
+        return pkg, required_version, None, None
+
+    if not is_outdated(release_date, cutoff):
+        latest = None
+    return pkg, required_version, release_date, latest
 
 
-def is_outdated(release_date, max_years):
-    return release_date and (datetime.now() - release_date).days / 365.25 > max_years
+def is_outdated(release_date, cutoff):
+    return release_date is not None and release_date < cutoff
 
 def extract_required_version(dep):
     try:
         req = Requirement(dep)
         for spec in req.specifier:
             if spec.operator in {">=", "=="}:
-                return req.name, Version(spec.version)
+                return req.name, _parse_version(spec.version)
         return req.name, None
     except Exception as e:
         print(f"Failed to parse {dep}: {e}")
         return None, None
 
+def _write_atomic(path, text):
+    """
+    Write text to path through a temporary file, so an interrupted run never leaves a half-written file.
+    """
+    # Replace the symlink target rather than the link, and keep the original file mode
+    target = os.path.realpath(path)
+    tmp = tempfile.NamedTemporaryFile("w", dir=os.path.dirname(target), prefix=".spec0-", delete=False)
+    try:
+        with tmp:
+            tmp.write(text)
+        shutil.copymode(target, tmp.name)
+        os.replace(tmp.name, target)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+
+
 def patch_requirements_file(path, outdated, dry_run=False):
-    with open(path, "r") as f:
-        lines = f.readlines()
+    lines = Path(path).read_text().splitlines(keepends=True)
+
+    new_map = {pkg: new_version for pkg, _, new_version in outdated}
 
     new_lines = []
     for line in lines:
@@ -107,89 +237,72 @@ def patch_requirements_file(path, outdated, dry_run=False):
             new_lines.append(line)
             continue
 
-        updated = False
-        for pkg, old_version, new_version in outdated:
-            pattern = re.compile(rf"^{re.escape(pkg)}\s*([<>=!~]=?.*)?$")
-            if pattern.match(stripped):
-                new_line = f"{pkg}>={new_version}\n"
-                print(f"{path}: {stripped} → {new_line.strip()}")
-                new_lines.append(new_line)
-                updated = True
-                break
-
-        if not updated:
+        match = REQUIREMENT_LINE_RE.match(stripped)
+        if match and match.group(1) in new_map:
+            pkg = match.group(1)
+            new_line = f"{pkg}>={new_map[pkg]}\n"
+            print(f"{path}: {stripped} → {new_line.strip()}")
+            new_lines.append(new_line)
+        else:
             new_lines.append(line)
 
-    if not dry_run:
-        with open(path, "w") as f:
-            f.writelines(new_lines)
+    if new_lines != lines and not dry_run:
+        _write_atomic(path, "".join(new_lines))
 
 
 def patch_pyproject_file(path, outdated, dry_run=False):
-    with open(path, "r") as f:
-        lines = f.readlines()
+    try:
+        doc = tomlkit.parse(Path(path).read_text())
+    except tomlkit.exceptions.ParseError as e:
+        print(f"Failed to parse {path}: {e}")
+        return
+
+    deps = doc.get("project", {}).get("dependencies")
+    if not deps:
+        return
+
+    old_map = {pkg: old_version for pkg, old_version, _ in outdated}
+    new_map = {pkg: new_version for pkg, _, new_version in outdated}
 
-    def get_line_package(line):
+    changed = False
+    for i, dep in enumerate(deps):
+        dep = str(dep)
         try:
-            req = Requirement(line.strip().strip('",'))
-            return req.name
+            pkg = Requirement(dep).name
         except Exception:
-            return None
-
-    new_lines = []
-    inside_deps = False
-    for line in lines:
-        stripped = line.strip()
-        if stripped.startswith("dependencies = ["):
-            inside_deps = True
-
-        if inside_deps and stripped.startswith("]"):
-            inside_deps = False
-
-        if inside_deps and stripped:
-            pkg = get_line_package(stripped)
-            if pkg:
-                replaced = False
-                for name, old_version, new_version in outdated:
-                    if pkg == name and old_version in line:
-                        new_line = re.sub(r">=?\s*[\d\.a-zA-Z]+", f">={new_version}", line)
-                        print(f"{path}: {line.strip()} → {new_line.strip()}")
-                        new_lines.append(new_line)
-                        replaced = True
-                        break
-                if not replaced:
-                    new_lines.append(line)
-            else:
-                new_lines.append(line)
-        else:
-            new_lines.append(line)
+            continue
+        if pkg in new_map and old_map[pkg] in dep:
+            new_dep = re.sub(r">=?\s*[\d\.a-zA-Z]+", f">={new_map[pkg]}", dep)
+            if new_dep != dep:
+                print(f"{path}: {dep} → {new_dep}")
+                deps[i] = new_dep
+                changed = True
 
-    if not dry_run:
-        with open(path, "w") as f:
-            f.writelines(new_lines)
+    if changed and not dry_run:
+        _write_atomic(path, tomlkit.dumps(doc))
 
 
 def patch_setup_py(path, outdated, dry_run=False):
-    with open(path, "r") as f:
-        lines = f.readlines()
+    lines = Path(path).read_text().splitlines(keepends=True)
+
+    old_map = {pkg: old_version for pkg, old_version, _ in outdated}
+    new_map = {pkg: new_version for pkg, _, new_version in outdated}
+
+    def replace(match):
+        pkg, version = match.groups()
+        if pkg in new_map and version == old_map[pkg]:
+            return f"{pkg}>={new_map[pkg]}"
+        return match.group(0)
 
     new_lines = []
     for line in lines:
-        updated = False
-        for pkg, old_version, new_version in outdated:
-            pattern = re.compile(rf"{re.escape(pkg)}\s*[<>=!~]=?\s*{re.escape(old_version)}")
-            if pattern.search(line):
-                new_line = pattern.sub(f"{pkg}>={new_version}", line)
-                print(f"{path}: {line.strip()} → {new_line.strip()}")
-                new_lines.append(new_line)
-                updated = True
-                break
-        if not updated:
-            new_lines.append(line)
+        new_line = SETUP_REQUIREMENT_RE.sub(replace, line)
+        if new_line != line:
+            print(f"{path}: {line.strip()} → {new_line.strip()}")
+        new_lines.append(new_line)
 
-    if not dry_run:
-        with open(path, "w") as f:
-            f.writelines(new_lines)
+    if new_lines != lines and not dry_run:
+        _write_atomic(path, "".join(new_lines))
 
 
 def commit_and_open_pr(branch="spec0-update", message="Update outdated dependencies (SPEC-0)", dry_run=False):
@@ -197,12 +310,20 @@ def commit_and_open_pr(branch="spec0-update", message="Update outdated dependenc
         print("Dry run mode: skipping git and PR creation.")
         return
 
-    subprocess.run(["git", "config", "--global", "user.email", "spec0-bot@users.noreply.github.com"])
-    subprocess.run(["git", "config", "--global", "user.name", "spec0-bot"])
-    subprocess.run(["git", "checkout", "-b", branch])
-    subprocess.run(["git", "add", "requirements.txt", "setup.py", "pyproject.toml"])
-    subprocess.run(["git", "commit", "-m", message])
-    subprocess.run(["git", "push", "origin", branch])
+    # Only pass files git tracks: a missing, untracked or ignored pathspec would make git abort the whole commit
+    tracked = subprocess.run(
+        ["git", "ls-files", "-z", "--", "requirements.txt", "setup.py", "pyproject.toml"],
+        check=True, capture_output=True, text=True,
+    )
+    paths = [p for p in tracked.stdout.split("\0") if p]
+    if not paths or subprocess.run(["git", "diff", "--quiet", "--", *paths]).returncode == 0:
+        print("No dependency file was changed; skipping git and PR creation.")
+        return
+
+    identity = ["-c", "user.email=spec0-bot@users.noreply.github.com", "-c", "user.name=spec0-bot"]
+    subprocess.run(["git", "checkout", "-b", branch], check=True)
+    subprocess.run(["git", *identity, "commit", "-m", message, "--", *paths], check=True)
+    subprocess.run(["git", "push", "origin", branch], check=True)
 
     if not Github:
         print("PyGithub is not installed; cannot open PR.")
@@ -257,17 +378,22 @@ def main(dry_run=False):
     deps = parse_requirements_txt(path)
     outdated_pkgs = []
 
+    pinned = []
     for dep in deps:
         pkg, required_version = extract_required_version(dep)
-        if not pkg or not required_version:
-            continue
-
-        release_date = get_release_date(pkg, str(required_version))
-        if release_date and is_outdated(release_date, SPEC0_DEP_AGE_YEARS):
-            latest = get_latest_version(pkg)
-            if latest:
-                outdated_pkgs.append((pkg, str(required_version), latest))
-                print(f"{pkg} >= {required_version} (released {release_date.date()}), oldest SPEC-0-compliant: {latest}")
+        if pkg and required_version:
+            pinned.append((pkg, required_version))
+
+    cutoff = spec0_cutoff()
+    # PyPI lookups are I/O bound, so threads sharing the pooled session run them in parallel
+    with ThreadPoolExecutor(max_workers=PYPI_MAX_WORKERS) as executor:
+        futures = [executor.submit(_check_one, pkg, required_version, cutoff) for pkg, required_version in pinned]
+
+    for future in futures:
+        pkg, required_version, release_date, latest = future.result()
+        if latest:
+            outdated_pkgs.append((pkg, str(required_version), latest))
+            print(f"{pkg} >= {required_version} (released {release_date.date()}), oldest SPEC-0-compliant: {latest}")
 
     if not outdated_pkgs:
         print("All dependencies are within the SPEC-0 window.")
@@ -0,0 +1,102 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import spec0_bot
+
+
+def _large_payload():
+    # Enough releases to push the response past PYPI_STREAM_THRESHOLD
+    releases = {
+        f"1.{i}.0": [{"upload_time_iso_8601": f"2024-01-01T00:00:{i % 60:02d}.000000Z", "filler": "x" * 200}]
+        for i in range(spec0_bot.PYPI_STREAM_THRESHOLD // 200 + 100)
+    }
+    return json.dumps({"info": {}, "releases": releases}).encode()
+
+
+@pytest.fixture
+def pypi_server(monkeypatch):
+    body = _large_payload()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(spec0_bot, "PYPI_URL", f"http://127.0.0.1:{server.server_port}/pypi/{{}}/json")
+    yield
+    server.shutdown()
+
+
+def test_fetch_twice_from_cache(pypi_server, tmp_path, monkeypatch):
+    requests_cache = pytest.importorskip("requests_cache")
+    session = requests_cache.CachedSession(cache_name=str(tmp_path / "pypi"), backend="sqlite")
+    monkeypatch.setattr(spec0_bot, "_SESSION", session)
+
+    results = []
+    for _ in range(2):
+        spec0_bot._fetch_pypi_json.cache_clear()
+        results.append(spec0_bot._fetch_pypi_json("numpy"))
+
+    assert results[0]["releases"] == results[1]["releases"]
+    assert results[1]["releases"]["1.0.0"][0]["upload_time_iso_8601"].startswith("2024-01-01")
+    spec0_bot._fetch_pypi_json.cache_clear()
+
+
+def test_fetch_streams_without_cache(pypi_server, monkeypatch):
+    pytest.importorskip("ijson")
+    monkeypatch.setattr(spec0_bot, "requests_cache", None)
+    monkeypatch.setattr(spec0_bot, "_SESSION", spec0_bot.requests.Session())
+
+    spec0_bot._fetch_pypi_json.cache_clear()
+    data = spec0_bot._fetch_pypi_json("numpy")
+    spec0_bot._fetch_pypi_json.cache_clear()
+
+    # The streamed result keeps only the upload time of each release
+    assert data["releases"]["1.0.0"] == [{"upload_time_iso_8601": "2024-01-01T00:00:00.000000Z"}]
+
+
+def test_write_atomic_keeps_mode_and_symlink(tmp_path):
+    target = tmp_path / "setup.py"
+    target.write_text("old\n")
+    target.chmod(0o755)
+    link = tmp_path / "link.py"
+    link.symlink_to(target)
+
+    spec0_bot._write_atomic(str(link), "new\n")
+
+    assert link.is_symlink()
+    assert target.read_text() == "new\n"
+    assert target.stat().st_mode & 0o777 == 0o755
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["link.py", "setup.py"]
+
+
+def test_patch_pyproject_skips_unparsable_file(tmp_path):
+    path = tmp_path / "pyproject.toml"
+    path.write_text("[project\ndependencies = [\"numpy>=1.20\"]\n")
+
+    spec0_bot.patch_pyproject_file(str(path), [("numpy", "1.20", "1.24")])
+
+    assert path.read_text() == "[project\ndependencies = [\"numpy>=1.20\"]\n"
+
+
+def test_patch_pyproject_leaves_exact_pins_alone(tmp_path, capsys):
+    path = tmp_path / "pyproject.toml"
+    path.write_text("[project]\ndependencies = [\n    \"requests==2.20\",  # pinned\n]\n")
+    mtime = path.stat().st_mtime_ns
+
+    spec0_bot.patch_pyproject_file(str(path), [("requests", "2.20", "2.31")])
+
+    assert path.stat().st_mtime_ns == mtime
+    assert "→" not in capsys.readouterr().out